@@ -1,12 +1,24 @@
+import io
+import hashlib
 import streamlit as st
 import pandas as pd
 import numpy as np
 import altair as alt
 
+# dtype of Final_Grade; categories are in chart order with 'I'
+# (attendance shortage) placed last
+GRADE_CATS = pd.CategoricalDtype(
+    categories=['Z', 'F', 'D', 'C', 'C+', 'B', 'B+', 'A', 'A+', 'O', 'I']
+)
+GRADE_CODES = {g: i for i, g in enumerate(GRADE_CATS.categories)}
+
 # ==========================================
 # 1. CORE GRADING LOGIC
 # ==========================================
 class StrictUniversityGrading:
+    # Grade ladder from lowest to highest; each grade above 'F' has a boundary
+    GRADE_ORDER = ['F', 'D', 'C', 'C+', 'B', 'B+', 'A', 'A+']
+
     def __init__(self, total_max_marks=100, ese_max_marks=60, course_type='Theory', protocol='Protocol A'):
         self.M = total_max_marks       
         self.ESE_M = ese_max_marks     
@@ -20,44 +32,58 @@ class StrictUniversityGrading:
             self.P = 0.40 * self.M 
 
     def process_results(self, df):
-        results = df.copy()
         debug_logs = []
 
+        # Pull the columns out as NumPy arrays once; grades are built as
+        # GRADE_CATS codes in 'final_grade' and only attached to the input
+        # at the end, so the input frame is never copied up front
+        attendance = df['attendance'].to_numpy(dtype=float)
+        marks = df['marks'].to_numpy(dtype=float)
+        final_grade = np.full(len(df), -1, dtype=np.int8)
+
         # 1. Attendance Verification
-        results['Final_Grade'] = np.where(results['attendance'] < 75, 'I', None)
+        mask_short = attendance < 75
+        final_grade[mask_short] = GRADE_CODES['I']
+        ungraded = ~mask_short
+
+        # Convert ESE to numeric once (AB/Errors become NaN here, 0 below)
+        ese_numeric = pd.to_numeric(df['ese_marks'], errors='coerce')
 
         # 2. Check for ABSENT (AB) in ESE
-        # Create a mask for rows where ese_marks is 'AB' (case insensitive)
-        mask_absent = results['ese_marks'].astype(str).str.upper() == 'AB'
+        # Only non-numeric entries can be 'AB' (case insensitive)
+        mask_absent = (ese_numeric.isna() & df['ese_marks'].isin(['AB', 'Ab', 'aB', 'ab'])).to_numpy()
         
         if mask_absent.any():
             count_absent = mask_absent.sum()
             debug_logs.append(f"⚠️ {count_absent} students marked 'AB' (Absent) in ESE. Assigned Grade 'Z'.")
-            results.loc[mask_absent & (results['Final_Grade'].isnull()), 'Final_Grade'] = 'Z'
+            final_grade[mask_absent & ungraded] = GRADE_CODES['Z']
+            ungraded &= ~mask_absent
 
-        # Convert ESE to numeric for checks (treat AB/Errors as 0)
-        results['ese_marks_numeric'] = pd.to_numeric(results['ese_marks'], errors='coerce').fillna(0)
+        # Treat AB/Errors as 0 for the remaining checks
+        ese_marks = ese_numeric.fillna(0).to_numpy(dtype=float)
 
         # 3. ESE Minimum Marks Check
         # Rule: Fail if ESE marks < 20% of ESE MAXIMUM
         min_ese_threshold = 0.20 * self.ESE_M
         
         # Identify students who failed ESE (and aren't I or Z)
-        mask_ese_fail = (results['Final_Grade'].isnull()) & (results['ese_marks_numeric'] < min_ese_threshold)
+        mask_ese_fail = ungraded & (ese_marks < min_ese_threshold)
         
         if mask_ese_fail.any():
             count_ese_fail = mask_ese_fail.sum()
             debug_logs.append(f"⚠️ {count_ese_fail} students failed ESE (Scored < {min_ese_threshold:.1f}). Grade 'F' assigned.")
-            results.loc[mask_ese_fail, 'Final_Grade'] = 'F'
+            final_grade[mask_ese_fail] = GRADE_CODES['F']
+            ungraded &= ~mask_ese_fail
 
         # 4. Filter Students for Statistics based on PROTOCOL
         # ---------------------------------------------------------
+        eligible = attendance >= 75
         if self.protocol == 'Protocol A (Exclusive)':
             # EXCLUDE ESE Failures and Absentees from Mean/SD
             # Only use students who passed the hurdles
             stats_mask = (
-                (results['attendance'] >= 75) & 
-                (results['ese_marks_numeric'] >= min_ese_threshold)
+                eligible & 
+                (ese_marks >= min_ese_threshold)
             )
             debug_logs.append(f"ℹ️ Protocol A Active: Statistics computed using ONLY students who passed ESE (>{min_ese_threshold}).")
             
@@ -65,11 +91,11 @@ class StrictUniversityGrading:
             # Protocol B (Inclusive)
             # INCLUDE ESE Failures (0 marks) in Mean/SD
             # Only exclude Attendance defaulters ('I')
-            stats_mask = (results['attendance'] >= 75)
+            stats_mask = eligible
             debug_logs.append(f"ℹ️ Protocol B Active: Statistics INCLUDE students who failed ESE (Zero-Inflation).")
         # ---------------------------------------------------------
 
-        regular_students = results.loc[stats_mask, 'marks'].values
+        regular_students = marks[stats_mask]
         count = len(regular_students)
         
         # 5. Formula Type Selection
@@ -84,33 +110,29 @@ class StrictUniversityGrading:
 
         # 6. Grade Assignment
         # Apply boundaries only to students who don't already have a grade (I, F, Z)
-        mask = results['Final_Grade'].isnull()
-        results.loc[mask, 'Final_Grade'] = results.loc[mask, 'marks'].apply(
-            lambda x: self._assign_grade(x, boundaries)
-        )
+        final_grade[ungraded] = self._assign_grades(marks[ungraded], boundaries)
+
+        # Raw average of eligible students, reported alongside the grades
+        raw_average = pd.Series(marks[eligible]).mean()
 
-        results = results.drop(columns=['ese_marks_numeric'])
-        return results, boundaries, method, debug_logs
+        results = df.assign(Final_Grade=pd.Categorical.from_codes(final_grade, dtype=GRADE_CATS))
+        return results, boundaries, method, debug_logs, raw_average
 
     def _calculate_relative_boundaries(self, marks):
-        X = np.mean(marks) 
-        sigma = np.std(marks)
+        # Population SD over centred values (as np.std) to avoid cancellation
+        marks = np.asarray(marks, dtype=float)
+        n = marks.size
+        X = marks.sum() / n
+        d = marks - X
+        sigma = np.sqrt(np.sum(d * d) / n)
         logs = []
         
         logs.append(f"Batch Statistics: Mean (X)={X:.2f}, SD (sigma)={sigma:.2f}")
 
-        # Base Formula
-        raw_D_limit = X - 1.5 * sigma
-        
-        bounds = {
-            'A+': X + 1.5 * sigma,
-            'A':  X + 1.0 * sigma,
-            'B+': X + 0.5 * sigma,
-            'B':  X,
-            'C+': X - 0.5 * sigma,
-            'C':  X - 1.0 * sigma,
-            'D':  raw_D_limit
-        }
+        # Base Formula: boundaries at X + k*sigma, highest grade first
+        coeffs = np.array([1.5, 1.0, 0.5, 0.0, -0.5, -1.0, -1.5])
+        bounds = dict(zip(['A+', 'A', 'B+', 'B', 'C+', 'C', 'D'], (X + coeffs * sigma).tolist()))
+        raw_D_limit = bounds['D']
 
         # --- CONDITION 1: MODERATION RULE ---
         if raw_D_limit > self.P:
@@ -140,6 +162,18 @@ class StrictUniversityGrading:
         else: 
             return {'A+': 90, 'A': 80, 'B+': 70, 'B': 62, 'C+': 58, 'C': 54, 'D': 50}
 
+    def _assign_grades(self, marks, bounds):
+        # Vectorized equivalent of _assign_grade over a whole array of marks,
+        # returning GRADE_CATS codes rather than labels.
+        # Thresholds are ordered D..A+; the reverse running minimum keeps them
+        # monotone even when A+ has been capped below A (Max Marks Protection).
+        thr = np.array([bounds[g] for g in self.GRADE_ORDER[1:]], dtype=float)
+        thr = np.minimum.accumulate(thr[::-1])[::-1]
+        idx = np.searchsorted(thr, marks, side='right')
+        idx[np.isnan(marks)] = 0  # Missing marks fall through to 'F'
+        ladder = np.array([GRADE_CODES[g] for g in self.GRADE_ORDER], dtype=np.int8)
+        return ladder[idx]
+
     def _assign_grade(self, marks, bounds):
         if marks >= bounds['A+']: return 'A+'
         if marks >= bounds['A']:  return 'A'
@@ -153,6 +187,51 @@ class StrictUniversityGrading:
 # ==========================================
 # 2. STREAMLIT WEB INTERFACE
 # ==========================================
+# Bounds for the caches below: each entry holds a full upload or result,
+# so keep only recent ones and drop anything idle for an hour
+CACHE_MAX_ENTRIES = 16
+CACHE_TTL = 3600
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def load_student_csv(file_hash, _file_bytes):
+    # Cached on the MD5 of the upload so widget reruns skip re-parsing
+    # PyArrow parses in multithreaded C (pyarrow ships with Streamlit), but
+    # it rejects short rows and keeps duplicate headers as-is; fall back to
+    # the default parser, which pads with NaN and renames to 'marks.1'
+    try:
+        df = pd.read_csv(io.BytesIO(_file_bytes), engine='pyarrow')
+    except pd.errors.ParserError:
+        df = None
+    if df is None or df.columns.duplicated().any():
+        df = pd.read_csv(io.BytesIO(_file_bytes))
+    df.columns = [c.strip().lower() for c in df.columns]
+    return df
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def grade_batch(file_hash, _df, max_marks, ese_max_marks, course_type, protocol):
+    # Grading is a pure function of the upload and the sidebar configuration
+    engine = StrictUniversityGrading(
+        total_max_marks=max_marks, 
+        ese_max_marks=ese_max_marks, 
+        course_type=course_type,
+        protocol=protocol
+    )
+    return engine.process_results(_df)
+
+@st.cache_data(show_spinner=False, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL)
+def df_to_csv_bytes(cache_key, _df):
+    # Keyed on the inputs the frame was derived from rather than on the
+    # frame itself: hashing it would cost a pass per rerun and, for large
+    # frames, Streamlit only hashes a sample of rows
+    return _df.to_csv(index=False).encode('utf-8')
+
+SAMPLE_DATA = pd.DataFrame({
+    'id': [1, 2, 3, 4, 5],
+    'marks': [82, 65, 45, 32, 91],
+    'attendance': [90, 85, 80, 76, 95],
+    'ese_marks': [40, 30, 'AB', 10, 50] 
+})
+
 def main():
     st.set_page_config(page_title="Grading Automation Tool", layout="wide")
     
@@ -194,37 +273,27 @@ def main():
         st.markdown("### Upload Data")
         uploaded_file = st.file_uploader("Upload Student CSV", type=["csv"])
         
-        sample_data = pd.DataFrame({
-            'id': [1, 2, 3, 4, 5],
-            'marks': [82, 65, 45, 32, 91],
-            'attendance': [90, 85, 80, 76, 95],
-            'ese_marks': [40, 30, 'AB', 10, 50] 
-        })
-        csv = sample_data.to_csv(index=False).encode('utf-8')
+        csv = df_to_csv_bytes('template', SAMPLE_DATA)
         st.download_button("Download CSV Template", csv, "template.csv", "text/csv")
 
     if uploaded_file is not None:
         try:
-            df = pd.read_csv(uploaded_file)
-            df.columns = df.columns.str.strip().str.lower()
+            file_bytes = uploaded_file.getvalue()
+            file_hash = hashlib.md5(file_bytes).hexdigest()
+            df = load_student_csv(file_hash, file_bytes)
             
             required_cols = {'id', 'marks', 'attendance', 'ese_marks'}
             if not required_cols.issubset(df.columns):
                 st.error(f"Error: CSV must contain columns: {list(required_cols)}")
             else:
-                engine = StrictUniversityGrading(
-                    total_max_marks=max_marks, 
-                    ese_max_marks=ese_max_marks, 
-                    course_type=course_type,
-                    protocol=protocol_choice  # Pass user choice
+                processed_df, boundaries, method, logs, avg_score = grade_batch(
+                    file_hash, df, max_marks, ese_max_marks, course_type,
+                    protocol_choice  # Pass user choice
                 )
-                processed_df, boundaries, method, logs = engine.process_results(df)
 
                 # 1. METRICS
                 col1, col2, col3, col4 = st.columns(4)
-                valid_students = df[df['attendance']>=75]
-                avg_score = valid_students['marks'].mean()
-                pass_count = len(processed_df[~processed_df['Final_Grade'].isin(['F', 'I', 'Z'])])
+                pass_count = (~processed_df['Final_Grade'].isin(['F', 'I', 'Z'])).sum()
                 
                 col1.metric("Total Students", len(df))
                 col2.metric("Raw Average", f"{avg_score:.2f}")
@@ -247,16 +316,16 @@ def main():
                 with c1:
                     st.subheader("📊 Grade Distribution")
                     
-                    grade_order = ['Z', 'F', 'D', 'C', 'C+', 'B', 'B+', 'A', 'A+', 'O']
-                    grade_counts = processed_df['Final_Grade'].value_counts().reset_index()
-                    grade_counts.columns = ['Grade', 'Count']
+                    # Count over categorical codes, keeping only grades that occur
+                    counts = processed_df['Final_Grade'].value_counts(sort=False)
+                    grade_counts = counts[counts > 0].rename_axis('Grade').reset_index(name='Count')
                     
                     chart = alt.Chart(grade_counts).mark_area(
                         interpolate='monotone', 
                         fillOpacity=0.6,
                         color='teal'
                     ).encode(
-                        x=alt.X('Grade', sort=grade_order),
+                        x=alt.X('Grade', sort=list(GRADE_CATS.categories)),
                         y='Count',
                         tooltip=['Grade', 'Count']
                     ).properties(height=300)
@@ -270,14 +339,21 @@ def main():
 
                 with c2:
                     st.subheader("📋 Student Results")
-                    def highlight_fail(row):
-                        if row['Final_Grade'] in ['F', 'I', 'Z']:
-                            return ['background-color: #ffcccc'] * len(row)
-                        return [''] * len(row)
+                    def highlight_fail(data):
+                        # Build the whole CSS matrix at once instead of one call per row
+                        failed = data['Final_Grade'].isin(['F', 'I', 'Z']).to_numpy()
+                        css = np.where(failed, 'background-color: #ffcccc', '')
+                        return pd.DataFrame(
+                            np.repeat(css[:, None], data.shape[1], axis=1),
+                            index=data.index, columns=data.columns
+                        )
 
-                    st.dataframe(processed_df.style.apply(highlight_fail, axis=1), use_container_width=True)
+                    st.dataframe(processed_df.style.apply(highlight_fail, axis=None), use_container_width=True)
                     
-                    res_csv = processed_df.to_csv(index=False).encode('utf-8')
+                    res_csv = df_to_csv_bytes(
+                        (file_hash, max_marks, ese_max_marks, course_type, protocol_choice),
+                        processed_df
+                    )
                     st.download_button("📥 Download Final Result CSV", res_csv, 'final_grades.csv', 'text/csv')
 
         except Exception as e:
@@ -8,41 +8,52 @@ import altair as alt
 # ==========================================
 # 1. DATABASE INITIALIZATION
 # ==========================================
+def get_db_connection():
+    # One long-lived connection per session instead of open/close per call
+    if 'db' not in st.session_state:
+        conn = sqlite3.connect('semester_data.db', check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        st.session_state['db'] = conn
+    return st.session_state['db']
+
 def init_db():
-    conn = sqlite3.connect('semester_data.db')
-    c = conn.cursor()
-    # Table for raw mark entries
-    c.execute('''CREATE TABLE IF NOT EXISTS marks_entry (
-                    student_id TEXT,
-                    subject_code TEXT,
-                    subject_name TEXT,
-                    credits INTEGER,
-                    course_type TEXT,
-                    total_max INTEGER,
-                    ese_max INTEGER,
-                    marks INTEGER,
-                    ese_marks TEXT,
-                    attendance INTEGER,
-                    faculty_name TEXT,
-                    timestamp TEXT,
-                    PRIMARY KEY (student_id, subject_code)
-                 )''')
-    conn.commit()
-    conn.close()
+    conn = get_db_connection()
+    # 'with conn' commits on success and rolls back on error, so a failed
+    # statement never leaves a transaction open on the shared connection
+    with conn:
+        c = conn.cursor()
+        # Table for raw mark entries
+        c.execute('''CREATE TABLE IF NOT EXISTS marks_entry (
+                        student_id TEXT,
+                        subject_code TEXT,
+                        subject_name TEXT,
+                        credits INTEGER,
+                        course_type TEXT,
+                        total_max INTEGER,
+                        ese_max INTEGER,
+                        marks INTEGER,
+                        ese_marks TEXT,
+                        attendance INTEGER,
+                        faculty_name TEXT,
+                        timestamp TEXT,
+                        PRIMARY KEY (student_id, subject_code)
+                     )''')
+
+def save_marks_bulk(rows):
+    # Single transaction (one commit/fsync) for any number of entries
+    conn = get_db_connection()
+    with conn:
+        conn.executemany('''INSERT OR REPLACE INTO marks_entry 
+                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', rows)
 
 def save_mark_to_db(data):
-    conn = sqlite3.connect('semester_data.db')
-    c = conn.cursor()
-    c.execute('''INSERT OR REPLACE INTO marks_entry 
-                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', data)
-    conn.commit()
-    conn.close()
+    save_marks_bulk([data])
 
 def get_all_marks_from_db():
-    conn = sqlite3.connect('semester_data.db')
-    df = pd.read_sql_query("SELECT * FROM marks_entry", conn)
-    conn.close()
-    return df
+    conn = get_db_connection()
+    return pd.read_sql_query("SELECT * FROM marks_entry", conn)
 
 # Initialize DB on startup
 init_db()